@@ -1,17 +1,29 @@
 import os
+import time
 import logging
 import datetime
-from fastapi import FastAPI, HTTPException, Request, Header, Query
+from fastapi import FastAPI, HTTPException, Request, Header, Query, Depends
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
-from pydantic import BaseModel, Field, field_validator
-from .models import messages, create_db_and_tables, engine
+from pydantic import BaseModel, Field, field_validator, ValidationError
+from .models import messages, create_db_and_tables, engine, SessionLocal, get_session
 from .storage import insert_message
-from .logging_utils import log_requests
+from .logging_utils import LogMiddleware
 from typing import Annotated, Optional
-from sqlalchemy import text
+from sqlalchemy import text, func, tuple_
 import hmac
-import hashlib
+import orjson
+import anyio.to_thread
+import threading
+from cachetools import LRUCache
+
+
+class ORJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NAIVE_UTC)
 
 
 E164Phone = Annotated[str, Field(pattern=r"^\+\d+$")]
@@ -28,29 +40,52 @@ class WebhookPayload(BaseModel):
         if not v.endswith("Z"):
             raise ValueError("Timestamp must end with 'Z' (UTC suffix)")
         
+        # fromisoformat accepts the trailing "Z" natively on Python 3.11+,
+        # so no intermediate string is allocated.
         try:
-            datetime.datetime.fromisoformat(v.replace("Z", "+00:00"))
+            datetime.datetime.fromisoformat(v)
         except ValueError:
             raise ValueError("Invalid ISO-8601 format")
             
         return v
     
 
-app = FastAPI()
-app.middleware("http")(log_requests)
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_middleware(LogMiddleware)
 logger = logging.getLogger("uvicorn.error")
 
+# Resolved once at import time: avoids two env lookups and a .encode()
+# on every webhook call. None means the secret was never configured.
+_WEBHOOK_KEY: bytes | None = (os.getenv("WEBHOOK_SECRET") or "").encode() or None
+
+# Negative cache of recently-seen message_ids so repeated webhook
+# deliveries skip the DB round-trip. The DB stays the source of truth:
+# a miss here just falls through to the upsert.
+_seen_ids = LRUCache(maxsize=100_000)
+_seen_lock = threading.Lock()
+
 def is_webhook_secret_set() -> bool:
-    return bool(os.getenv("WEBHOOK_SECRET"))
+    return _WEBHOOK_KEY is not None
+
+# Probes from k8s and load balancers can hit /health/ready every second;
+# caching the last result briefly keeps that traffic off the database.
+_READY_TTL_SECONDS = 2.0
+_ready_cache = {"checked_at": 0.0, "ok": False}
 
 def is_db_ready() -> bool:
+    now = time.monotonic()
+    if now - _ready_cache["checked_at"] < _READY_TTL_SECONDS:
+        return _ready_cache["ok"]
     try:
-        with Session(engine) as session:
-            session.exec(text("SELECT 1 FROM messages LIMIT 1"))
-        return True
+        with SessionLocal() as session:
+            session.exec(text("SELECT 1"))
+        ok = True
     except Exception as e:
         logger.error(f"DB readiness check failed: {e}")
-        return False
+        ok = False
+    _ready_cache["checked_at"] = now
+    _ready_cache["ok"] = ok
+    return ok
     
 @app.on_event("startup")
 def on_startup():
@@ -58,6 +93,9 @@ def on_startup():
         create_db_and_tables()
     except Exception as e:
         raise Exception(f"the models could not be created successfully: {e}")
+    # Sync handlers run in the anyio threadpool; the default of 40 threads
+    # caps concurrency well below what the DB pool can serve.
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 200
 
 @app.get("/health/live")
 def fit_check():
@@ -78,17 +116,41 @@ def ready_check():
 		status_code=200
 	)
     
+# Generous ceiling for a payload whose text field caps at 4096 bytes;
+# keeps HMAC and parse work bounded under adversarial load.
+MAX_BODY_BYTES = 64 * 1024
+
+async def get_body(request: Request) -> bytes:
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail="payload too large")
+
+    # Stream with a running total so chunked uploads can't bypass the
+    # Content-Length check.
+    chunks = []
+    total = 0
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="payload too large")
+        chunks.append(chunk)
+    body = b"".join(chunks)
+    # Cache on the request so any later request.body() reuses these bytes.
+    request._body = body
+    return body
+
+
 @app.post("/webhook")
-async def webhook(
+def webhook(
     request: Request,
-	payload: WebhookPayload,
-	x_signature: Annotated[str, Header()]
+	x_signature: Annotated[str, Header()],
+	body_bytes: bytes = Depends(get_body),
+	db: Session = Depends(get_session)
 ):
-    body_bytes = await request.body()
     extra_info = {
         "result": None,
         "dup": False,
-        "message_id": getattr(payload, "message_id", None)
+        "message_id": None
     }
     
     if not is_webhook_secret_set():
@@ -97,32 +159,55 @@ async def webhook(
         request.state.extra_info = extra_info
         raise HTTPException(status_code=401, detail="webhook missing")
 
-    if not x_signature:
-        logger.error("Missing X-Signature header")
-        extra_info["result"] = "invalid_signature"
-        request.state.extra_info = extra_info
-        raise HTTPException(status_code=401, detail="invalid_signature")
+    # Malformed or missing signatures must not return faster than a wrong
+    # one, so hex-decode failures fall through to the same constant-time
+    # compare against a dummy value.
+    try:
+        sig_bytes = bytes.fromhex(x_signature)
+    except ValueError:
+        sig_bytes = b"\x00" * 32
 
-    expected_signature = hmac.new(
-    	key=os.getenv("WEBHOOK_SECRET").encode(),
-    	msg=body_bytes,
-    	digestmod=hashlib.sha256 
-	).hexdigest()
+    # hmac.digest is a one-shot that stays inside OpenSSL, picking up
+    # hardware SHA extensions without the hmac.new object overhead.
+    expected_signature = hmac.digest(_WEBHOOK_KEY, body_bytes, "sha256")
     
-    if not hmac.compare_digest(expected_signature, x_signature):
+    if not hmac.compare_digest(expected_signature, sig_bytes):
         logger.error("Invalid HMAC signature")
         extra_info["result"] = "invalid_signature"
         request.state.extra_info = extra_info
         raise HTTPException(status_code=401, detail="invalid_signature")
 
+    # The bytes were already read for the HMAC, so validate them directly
+    # with pydantic-core's JSON parser instead of having FastAPI parse the
+    # body a second time.
+    try:
+        payload = WebhookPayload.model_validate_json(body_bytes)
+    except ValidationError as e:
+        extra_info["result"] = "validation_error"
+        request.state.extra_info = extra_info
+        raise RequestValidationError(e.errors())
+    extra_info["message_id"] = payload.message_id
+
+    with _seen_lock:
+        already_seen = payload.message_id in _seen_ids
+    if already_seen:
+        extra_info.update({
+            "result": "duplicate",
+            "dup": True
+        })
+        request.state.extra_info = extra_info
+        return {"status": "ok"}
+
     try:
-        with Session(engine) as db:
-            res = insert_message(db, payload)
-            extra_info.update({
-                "result": res,
-                "dup": res == "duplicate"
-            })
-            request.state.extra_info = extra_info
+        res = insert_message(db, payload)
+        if res in ("created", "duplicate"):
+            with _seen_lock:
+                _seen_ids[payload.message_id] = True
+        extra_info.update({
+            "result": res,
+            "dup": res == "duplicate"
+        })
+        request.state.extra_info = extra_info
         return {"status": "ok"}
     
     except Exception as e:
@@ -138,76 +223,101 @@ def get_messages(
     offset: int | None = Query(0, ge=0),
     from_msisdn: str | None = Query(None, alias="from"),
     since: str | None = Query(None),
-    q: Optional[str] = None
+    q: Optional[str] = None,
+    after_ts: str | None = Query(None),
+    after_id: str | None = Query(None),
+    session: Session = Depends(get_session)
 ):
 
     if since is not None:
         try:
-            datetime.datetime.fromisoformat(since.replace("Z", "+00:00"))
+            datetime.datetime.fromisoformat(since)
         except Exception:
             raise HTTPException(status_code=422, detail="since must be ISO-8601 UTC timestamp")
-        
-    with Session(engine) as session:
-        stmt = select(messages)
-
-        if from_msisdn:
-            stmt = stmt.where(messages.from_msisdn == from_msisdn)
-        if since:
-            stmt = stmt.where(messages.ts >= since)
-        if q:
-            stmt = stmt.where(messages.text.ilike(f"%{q}%"))
-        
-        total = len(session.exec(stmt).all())
-        stmt = stmt.order_by(messages.ts.asc(), messages.message_id.asc())
-        stmt = stmt.offset(offset).limit(limit)
-        data = session.exec(stmt).all()
-
-        data_dicts = [m.model_dump(by_alias=True) for m in data]
-        return {
-            "data": data_dicts,
-            "total": total,
-            "limit": limit,
-            "offset": offset
-        }
-    
 
-@app.get("/stats")
-def get_stats():
-    with Session(engine) as session:
-        # Total messages
-        total_messages = session.exec(
-            text("SELECT COUNT(*) FROM messages")
-        ).one()[0]
-
-        # Unique senders
-        senders_count = session.exec(
-            text("SELECT COUNT(DISTINCT from_msisdn) FROM messages")
-        ).one()[0]
-
-        # Messages per sender (top 10)
-        mps = session.exec(
-            text("""
-                SELECT from_msisdn AS "from", COUNT(*) AS count
+    clauses = []
+    if from_msisdn:
+        clauses.append(messages.from_msisdn == from_msisdn)
+    if since:
+        clauses.append(messages.ts >= since)
+    if q:
+        clauses.append(messages.text.ilike(f"%{q}%"))
+
+    count_stmt = select(func.count()).select_from(messages).where(*clauses)
+    total = session.exec(count_stmt).one()
+
+    # Selecting labeled columns returns plain rows, skipping ORM
+    # hydration and the per-row model_dump(by_alias=True) pass.
+    stmt = select(
+        messages.message_id,
+        messages.from_msisdn.label("from"),
+        messages.to_msisdn.label("to"),
+        messages.ts,
+        messages.text,
+    ).where(*clauses).order_by(messages.ts.asc(), messages.message_id.asc())
+    # Keyset pagination: seeks straight to the cursor via the
+    # (ts, message_id) index instead of scanning and discarding
+    # `offset` rows. Preferred over offset for deep pages.
+    if after_ts and after_id:
+        stmt = stmt.where(
+            tuple_(messages.ts, messages.message_id) > tuple_(after_ts, after_id)
+        )
+    else:
+        stmt = stmt.offset(offset)
+    stmt = stmt.limit(limit)
+    rows = session.exec(stmt).all()
+
+    data_dicts = [dict(row._mapping) for row in rows]
+    next_cursor = (
+        {"after_ts": rows[-1].ts, "after_id": rows[-1].message_id}
+        if rows else None
+    )
+    return {
+        "data": data_dicts,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "next_cursor": next_cursor
+    }
+
+
+# The top-10 list is aggregated to JSON inside the database, so /stats is
+# one round-trip returning a single row and Python never rebuilds the
+# per-sender dicts. SQLite's aggregate keeps the ordered subquery's row
+# order; Postgres needs the explicit ORDER BY inside json_agg.
+if engine.dialect.name == "postgresql":
+    _TOP_JSON = "json_agg(json_build_object('from', from_msisdn, 'count', cnt) ORDER BY cnt DESC)"
+else:
+    _TOP_JSON = "json_group_array(json_object('from', from_msisdn, 'count', cnt))"
+
+_STATS_SQL = text(f"""
+    SELECT COUNT(*) AS total,
+           COUNT(DISTINCT from_msisdn) AS senders,
+           MIN(ts) AS first_ts, MAX(ts) AS last_ts,
+           (SELECT {_TOP_JSON}
+            FROM (
+                SELECT from_msisdn, COUNT(*) AS cnt
                 FROM messages
                 GROUP BY from_msisdn
-                ORDER BY count DESC
+                ORDER BY cnt DESC
                 LIMIT 10
-            """)
-        ).all()
-        messages_per_sender = [{"from": row[0], "count": row[1]} for row in mps]
-
-        # First and last message timestamps
-        first_ts = session.exec(
-            text("SELECT ts FROM messages ORDER BY ts ASC LIMIT 1")
-        ).first()
-        last_ts = session.exec(
-            text("SELECT ts FROM messages ORDER BY ts DESC LIMIT 1")
-        ).first()
-
-        return {
-            "total_messages": total_messages,
-            "senders_count": senders_count,
-            "messages_per_sender": messages_per_sender,
-            "first_message_ts": first_ts[0] if first_ts else None,
-            "last_message_ts": last_ts[0] if last_ts else None,
-        }
\ No newline at end of file
+            ) top) AS top_json
+    FROM messages
+""")
+
+
+@app.get("/stats")
+def get_stats(session: Session = Depends(get_session)):
+    row = session.exec(_STATS_SQL).one()
+
+    top = row[4]
+    if isinstance(top, str):
+        top = orjson.loads(top)
+
+    return {
+        "total_messages": row[0],
+        "senders_count": row[1],
+        "messages_per_sender": top or [],
+        "first_message_ts": row[2],
+        "last_message_ts": row[3],
+    }
\ No newline at end of file
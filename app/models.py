@@ -2,17 +2,23 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from typing import Optional
-from sqlmodel import Field, SQLModel, create_engine
+from sqlmodel import Field, SQLModel, Session, create_engine
+from sqlalchemy import Index, text
+from sqlalchemy.orm import sessionmaker
 from pydantic import ConfigDict
 import os
 
 class messages(SQLModel, table=True):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_msg_ts_id", "ts", "message_id"),
+        Index("ix_msg_from_ts", "from_msisdn", "ts"),
+    )
 
     message_id: str = Field(primary_key=True)
-    from_msisdn: str = Field(alias="from")
+    from_msisdn: str = Field(alias="from", index=True)
     to_msisdn: str = Field(alias="to")
-    ts: str
+    ts: str = Field(index=True)
     text: str | None = Field(default=None, max_length=4096)
 
     model_config = ConfigDict(
@@ -20,7 +26,32 @@ class messages(SQLModel, table=True):
     )
  
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+
+# Explicit pool sizing only makes sense for a networked database; the
+# SQLite dev/test setup keeps the driver defaults. query_cache_size
+# enlarges the compiled-statement cache shared across sessions so hot
+# ORM statements stay compiled.
+_engine_kwargs = {"pool_pre_ping": True, "query_cache_size": 1200}
+if DATABASE_URL and DATABASE_URL.startswith("postgres"):
+    _engine_kwargs.update(pool_size=20, max_overflow=10)
+engine = create_engine(DATABASE_URL, **_engine_kwargs)
+
+SessionLocal = sessionmaker(engine, class_=Session, expire_on_commit=False)
+
+def get_session():
+    with SessionLocal() as session:
+        yield session
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    SQLModel.metadata.create_all(engine)
+    # ILIKE '%q%' is unindexable by B-tree; a pg_trgm GIN index lets the
+    # Postgres planner answer it in O(matches) with no query changes.
+    # SQLite has no equivalent, so the dev setup keeps the scan.
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_msg_text_trgm "
+                "ON messages USING gin (text gin_trgm_ops)"
+            ))
+            conn.commit()
\ No newline at end of file
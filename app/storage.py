@@ -1,33 +1,33 @@
-from sqlmodel import Session, SQLModel, create_engine, select
-from sqlmodel import SQLModel, Session, select
+from sqlmodel import Session
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from datetime import datetime, timezone
-from typing import Optional
-from .models import messages
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import messages, engine
 import logging
 
 logger = logging.getLogger("uvicorn.error")
 
+# Both dialects expose the same on_conflict_do_nothing / RETURNING API
+# (SQLite needs 3.35+ for RETURNING).
+_insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+
 def insert_message(session: Session, payload) -> str:
 	try:
-		statement = select(messages).where(messages.message_id == payload.message_id)
-		existing_message = session.exec(statement).first()
-
-		if existing_message:
-			return "duplicate"
-
-		msg = messages(
-			message_id=payload.message_id,
-			from_msisdn=payload.from_msisdn,
-			to_msisdn=payload.to_msisdn,
-			ts=payload.ts,
-			text=payload.text
+		stmt = (
+			_insert(messages.__table__)
+			.values(
+				message_id=payload.message_id,
+				from_msisdn=payload.from_msisdn,
+				to_msisdn=payload.to_msisdn,
+				ts=payload.ts,
+				text=payload.text
+			)
+			.on_conflict_do_nothing(index_elements=["message_id"])
+			.returning(messages.__table__.c.message_id)
 		)
-
-		session.add(msg)
+		res = session.exec(stmt).first()
 		session.commit()
-		return "created"
+		return "created" if res else "duplicate"
 	except (IntegrityError, SQLAlchemyError) as e:
 		logger.error(f"policy issue: {e}")
 		session.rollback()
-